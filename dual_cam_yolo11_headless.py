@@ -3,19 +3,47 @@
 # Adds per-camera FPS overlay, YOLOv11n face detection + facial blurring, and a /stats endpoint.
 # Open http://<pi-ip>:8080/ in a browser. Quit with Ctrl+C.
 
+import os
 import cv2
 import time
+import queue
+import threading
 from collections import deque
+from functools import partial
 from flask import Flask, Response, render_template_string, jsonify
 import argparse
+import torch
 from ultralytics import YOLO
-from huggingface_hub import hf_hub_download
 
 # -------- YOLO model load --------
-print(" Loading local YOLO model: best.pt ...")
-model = YOLO("best.pt")   
-print("Local YOLO model loaded successfully.")
+MODEL_PATH = "best.pt"
 
+def load_model(path: str = MODEL_PATH) -> YOLO:
+    """Load a YOLO model from a weights file or export directory."""
+    print(f" Loading local YOLO model: {path} ...")
+    model = YOLO(path)
+    print("Local YOLO model loaded successfully.")
+    return model
+
+# -------- Per-deployment tuning (most are also CLI options) --------
+# Frames are downscaled to this width (INTER_AREA) before YOLO inference; it is
+# also the YOLO input size. Inference cost grows with its square.
+DETECT_WIDTH = 320
+# Minimum YOLO confidence for a face box.
+DETECT_CONF = 0.5
+# Upper bound on faces per frame (YOLO's default is 300); trims NMS/post-processing.
+MAX_FACES = 20
+# OpenCV's default; lower it with --jpeg-quality for cheaper encoding and less bandwidth.
+JPEG_QUALITY = 95
+# Captured frames waiting for the detector. One slot: the detector always gets
+# the newest frame, and anything it was too slow for is dropped, not queued.
+READ_QUEUE_SIZE = 1
+# Frames waiting for the JPEG encoder. Clients only ever get the newest part,
+# so one slot: a frame the encoder was too slow for is replaced, not encoded.
+ENCODE_RING_SIZE = 1
+# Blur boxes are grown by this fraction per side, so a face drifting below the
+# motion gate's threshold while boxes are reused stays covered.
+BLUR_PAD = 0.2
 
 # -------- Small FPS helper --------
 class FPSMeter:
@@ -35,6 +63,64 @@ class FPSMeter:
         self.t_prev = now
         return self.fps
 
+# -------- Motion gating --------
+MOTION_PIXEL_THRESH = 25  # grey-level change for a pixel to count as motion
+MIN_MOTION_AREA = 50      # moving pixels (on the downscaled frame) needed to run YOLO
+
+def motion_area(gray, ref, pixel_thresh: int = MOTION_PIXEL_THRESH) -> int:
+    """Count pixels whose grey level changed by more than `pixel_thresh`."""
+    diff = cv2.absdiff(gray, ref)
+    _, mask = cv2.threshold(diff, pixel_thresh, 255, cv2.THRESH_BINARY)
+    return cv2.countNonZero(mask)
+
+class MotionGate:
+    """Frame-difference prefilter: YOLO only runs when something moved."""
+    def __init__(self, pixel_thresh=MOTION_PIXEL_THRESH, min_area=MIN_MOTION_AREA):
+        self.pixel_thresh = pixel_thresh
+        self.min_area = min_area
+        self.prev = None
+
+    def moved(self, gray) -> bool:
+        prev, self.prev = self.prev, gray
+        if prev is None or prev.shape != gray.shape:
+            return True
+        return motion_area(gray, prev, self.pixel_thresh) >= self.min_area
+
+# -------- Detection scheduling --------
+FULL_SCAN_INTERVAL = 30  # frames after which YOLO runs even on a static scene
+
+class FrameSkipper:
+    """Reuse the last detections only while the scene is static.
+
+    Every frame the MotionGate flags as moving runs YOLO, so blur boxes never
+    lag a moving or newly arrived face. Other frames are also diffed against
+    the grey frame from the last YOLO pass, so slow drift that stays under
+    the per-frame gate still adds up and triggers a fresh detection. A full
+    scan every FULL_SCAN_INTERVAL frames picks up previously missed faces.
+    """
+    def __init__(self, full_scan=FULL_SCAN_INTERVAL,
+                 pixel_thresh=MOTION_PIXEL_THRESH, min_area=MIN_MOTION_AREA):
+        self.full_scan = full_scan
+        self.pixel_thresh = pixel_thresh
+        self.min_area = min_area
+        self.since = 0
+        self.boxes = []
+        self.ref = None
+
+    def should_detect(self, gray, moved: bool) -> bool:
+        self.since += 1
+        if moved or self.since >= self.full_scan:
+            return True
+        if self.ref is None or self.ref.shape != gray.shape:
+            return True
+        return motion_area(gray, self.ref, self.pixel_thresh) >= self.min_area
+
+    def update(self, boxes, gray):
+        self.boxes = boxes
+        # gray lives in a reused buffer, so keep a private copy as reference
+        self.ref = gray.copy()
+        self.since = 0
+
 # -------- Minimal HTML UI --------
 HTML = """
 <!doctype html>
@@ -85,57 +171,246 @@ def open_cam(dev: str, width: int, height: int) -> cv2.VideoCapture:
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, float(width))
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, float(height))
     cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    # Some drivers silently ignore these; a deeper buffer or YUYV means stale,
+    # slower frames, so say so instead of failing quietly.
+    if cap.isOpened():
+        if cap.get(cv2.CAP_PROP_BUFFERSIZE) != 1:
+            print(f"[{dev}] warning: driver ignored CAP_PROP_BUFFERSIZE=1; frames may lag")
+        if int(cap.get(cv2.CAP_PROP_FOURCC)) != cv2.VideoWriter_fourcc(*"MJPG"):
+            print(f"[{dev}] warning: camera did not accept MJPG; falling back to raw format")
     return cap
 
-def blur_faces(frame, results):
-    """Apply Gaussian blur to all YOLO-detected face bounding boxes."""
+def downscale(frame, dst=None, width: int = DETECT_WIDTH):
+    """Return an INTER_AREA copy of the frame at `width` and the scale used.
+
+    Pass the previous result as `dst` to resize into it instead of allocating.
+    """
+    h, w = frame.shape[:2]
+    scale = min(1.0, width / w)
+    if scale >= 1.0:
+        return frame, 1.0
+    small = cv2.resize(frame, (width, int(h * scale)), dst=dst,
+                       interpolation=cv2.INTER_AREA)
+    return small, scale
+
+def detect_faces(model: YOLO, small, scale: float, device=None,
+                 imgsz: int = DETECT_WIDTH, conf: float = DETECT_CONF,
+                 half: bool = False):
+    """Run YOLO on the downscaled frame; return boxes in full-frame coordinates."""
+    results = model.predict(small, imgsz=imgsz, conf=conf,
+                            max_det=MAX_FACES, device=device, half=half,
+                            verbose=False)
+    boxes = []
     for r in results:
-        if r.boxes is not None:
-            for box in r.boxes:
-                x1, y1, x2, y2 = box.xyxy[0].int().tolist()
-                # Clip coordinates safely
-                x1 = max(0, x1)
-                y1 = max(0, y1)
-                x2 = min(frame.shape[1], x2)
-                y2 = min(frame.shape[0], y2)
-                # Extract ROI and blur it
-                roi = frame[y1:y2, x1:x2]
-                if roi.size > 0:
-                    blur = cv2.GaussianBlur(roi, (45, 45), 30)
-                    frame[y1:y2, x1:x2] = blur
+        if r.boxes is not None and len(r.boxes):
+            # One device->host copy and one vectorised rescale per frame,
+            # instead of a tensor slice + .tolist() per box.
+            xyxy = (r.boxes.xyxy.cpu().numpy() / scale).astype(int)
+            boxes.extend(map(tuple, xyxy.tolist()))
+    return boxes
+
+def blur_faces(frame, boxes, pad: float = BLUR_PAD):
+    """Apply Gaussian blur to all detected face bounding boxes, padded by `pad`."""
+    for x1, y1, x2, y2 in boxes:
+        px = int((x2 - x1) * pad)
+        py = int((y2 - y1) * pad)
+        # Pad, then clip coordinates safely
+        x1 = max(0, x1 - px)
+        y1 = max(0, y1 - py)
+        x2 = min(frame.shape[1], x2 + px)
+        y2 = min(frame.shape[0], y2 + py)
+        # Extract ROI and blur it
+        roi = frame[y1:y2, x1:x2]
+        if roi.size > 0:
+            blur = cv2.GaussianBlur(roi, (45, 45), 30)
+            frame[y1:y2, x1:x2] = blur
     return frame
 
-def mjpeg_generator(cap: cv2.VideoCapture, meter: FPSMeter, label: str):
-    """Yield a motion-JPEG stream with YOLO face detection + blurring + FPS overlay."""
+def put_latest(q: queue.Queue, item):
+    """Put without blocking, dropping the oldest queued item if the queue is full."""
     while True:
-        ok, frame = cap.read()
-        if not ok:
-            continue
-
         try:
-            # --- YOLO face detection ---
-            results = model.predict(frame, imgsz=320, conf=0.5, verbose=False)
-            # --- Apply face blurring ---
-            frame = blur_faces(frame, results)
-        except Exception as e:
-            print(f"[{label}] YOLO error:", e)
-
-        # --- FPS overlay ---
-        fps = meter.tick()
-        text = f"{label}  FPS: {fps:.1f}"
-        cv2.putText(frame, text, (10, 28),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-
-        ok, buf = cv2.imencode(".jpg", frame)
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+# -------- Capture -> detect -> encode pipeline --------
+MJPEG_PART_HEADER = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n"
+
+class CameraPipeline:
+    """Per-camera reader, detector and encoder threads joined by bounded queues.
+
+    The reader never waits on YOLO (stale frames are dropped), and JPEG
+    encoding overlaps detection of the next frame. HTTP clients only read
+    the latest encoded frame, so extra viewers add no camera or YOLO work.
+    With no viewer connected the reader stops capturing and the whole
+    pipeline idles, as the old per-request generators did.
+    """
+    def __init__(self, cap: cv2.VideoCapture, meter: FPSMeter, label: str,
+                 model_path: str = MODEL_PATH, device=None,
+                 jpeg_quality: int = JPEG_QUALITY,
+                 detect_width: int = DETECT_WIDTH, conf: float = DETECT_CONF,
+                 overlay: bool = True, half: bool = False):
+        self.cap = cap
+        self.meter = meter
+        self.label = label
+        # Ultralytics models are not thread-safe, so each pipeline loads its own
+        # instance. This costs a second copy of the weights in RAM; main()
+        # splits torch's CPU threads between the cameras so the two detectors
+        # overlap instead of oversubscribing the cores.
+        self.model = load_model(model_path)
+        self.device = device
+        self.detect_width = detect_width
+        self.conf = conf
+        self.overlay = overlay
+        self.half = half
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)]
+        self.read_q = queue.Queue(maxsize=READ_QUEUE_SIZE)
+        # Detector -> encoder slot: the detector never blocks on encoding; if
+        # the encoder falls behind, the pending frame is replaced by the newest.
+        self.write_ring = deque(maxlen=ENCODE_RING_SIZE)
+        self.frame_ready = threading.Event()
+        self.cond = threading.Condition()
+        self.part = None
+        self.seq = 0
+        self.viewers = 0
+        self.running = False
+
+    def start(self) -> "CameraPipeline":
+        self.running = True
+        for target in (self._read_loop, self._detect_loop, self._encode_loop):
+            threading.Thread(target=target, name=f"{self.label}{target.__name__}",
+                             daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop the reader; a None sentinel then shuts down the other stages."""
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+
+    def attach(self):
+        """Register a streaming client; capture runs while at least one is attached."""
+        with self.cond:
+            self.viewers += 1
+            self.cond.notify_all()
+
+    def detach(self):
+        with self.cond:
+            self.viewers -= 1
+            if not self.viewers:
+                # Don't greet the next viewer with a frame from before the pause.
+                self.part = None
+
+    def latest(self, seq: int):
+        """Block until a frame newer than `seq` is encoded; return (part, seq)."""
+        with self.cond:
+            self.cond.wait_for(lambda: (self.part is not None and self.seq != seq)
+                               or not self.running)
+            return self.part, self.seq
+
+    def _read_loop(self):
+        # Every frame gets its own array: the detector and encoder may still
+        # hold earlier frames, and the allocation is negligible next to YOLO.
+        while self.running:
+            with self.cond:
+                self.cond.wait_for(lambda: self.viewers or not self.running)
+            ok, frame = self.cap.read()
+            if not ok:
+                continue
+            put_latest(self.read_q, frame)
+        put_latest(self.read_q, None)
+
+    def _detect_loop(self):
+        """Run detection + FPS overlay on each captured frame (keeps all detector state)."""
+        skipper = FrameSkipper()
+        gate = MotionGate()
+        # Reused per-frame buffers; grey ping-pongs because MotionGate keeps
+        # the previous frame's grey image.
+        small = None
+        grays = [None, None]
+        n = 0
+        # Settings are fixed for the pipeline's lifetime; bind them once.
+        detect = partial(detect_faces, self.model, device=self.device,
+                         imgsz=self.detect_width, conf=self.conf, half=self.half)
+        detect_width = self.detect_width
+        overlay = self.overlay
+        overlay_prefix = f"{self.label}  FPS: "
+        while True:
+            frame = self.read_q.get()
+            if frame is None:
+                break
+
+            try:
+                # --- YOLO face detection (skipped only on static frames) ---
+                small, scale = downscale(frame, small, detect_width)
+                n ^= 1
+                gray = grays[n] = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=grays[n])
+                if skipper.should_detect(gray, gate.moved(gray)):
+                    skipper.update(detect(small, scale), gray)
+                # --- Apply face blurring ---
+                if skipper.boxes:
+                    frame = blur_faces(frame, skipper.boxes)
+            except Exception as e:
+                print(f"[{self.label}] YOLO error:", e)
+
+            # --- FPS overlay (the number is always available from /stats) ---
+            fps = self.meter.tick()
+            if overlay:
+                text = f"{overlay_prefix}{fps:.1f}"
+                cv2.putText(frame, text, (10, 28),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+
+            self.write_ring.append(frame)
+            self.frame_ready.set()
+        self.write_ring.append(None)
+        self.frame_ready.set()
+
+    def _encode_loop(self):
+        while True:
+            self.frame_ready.wait()
+            self.frame_ready.clear()
+            while self.write_ring:
+                frame = self.write_ring.popleft()
+                if frame is None:
+                    with self.cond:
+                        self.cond.notify_all()
+                    return
+                self._publish(frame)
+
+    def _publish(self, frame):
+        ok, buf = cv2.imencode(".jpg", frame, self.encode_params)
         if not ok:
-            continue
+            return
+        # Build the multipart chunk once; every client yields the same bytes.
+        # join() reads the encoded array through the buffer protocol, so the
+        # JPEG is copied exactly once (no .tobytes() or intermediate concat).
+        part = b"".join((MJPEG_PART_HEADER, buf.reshape(-1), b"\r\n"))
+        with self.cond:
+            if self.viewers:
+                self.part = part
+                self.seq += 1
+                self.cond.notify_all()
 
-        yield (b"--frame\r\n"
-               b"Content-Type: image/jpeg\r\n\r\n" +
-               buf.tobytes() + b"\r\n")
+def mjpeg_generator(pipeline: CameraPipeline):
+    """Yield the pipeline's latest encoded frames as a motion-JPEG stream."""
+    pipeline.attach()
+    try:
+        seq = 0
+        while True:
+            part, seq = pipeline.latest(seq)
+            if part is None or not pipeline.running:
+                return
+            yield part
+    finally:
+        pipeline.detach()
 
 # -------- Flask app --------
-def build_app(cap0, cap1, fps0: FPSMeter, fps1: FPSMeter) -> Flask:
+def build_app(pipe0: CameraPipeline, pipe1: CameraPipeline) -> Flask:
     app = Flask(__name__)
 
     @app.route("/")
@@ -145,27 +420,48 @@ def build_app(cap0, cap1, fps0: FPSMeter, fps1: FPSMeter) -> Flask:
     @app.route("/cam0")
     def cam0():
         return Response(
-            mjpeg_generator(cap0, fps0, "cam0"),
+            mjpeg_generator(pipe0),
             mimetype="multipart/x-mixed-replace; boundary=frame"
         )
 
     @app.route("/cam1")
     def cam1():
         return Response(
-            mjpeg_generator(cap1, fps1, "cam1"),
+            mjpeg_generator(pipe1),
             mimetype="multipart/x-mixed-replace; boundary=frame"
         )
 
     @app.route("/stats")
     def stats():
         return jsonify({
-            "cam0_fps": round(fps0.fps, 2),
-            "cam1_fps": round(fps1.fps, 2)
+            "cam0_fps": round(pipe0.meter.fps, 2),
+            "cam1_fps": round(pipe1.meter.fps, 2)
         })
 
     return app
 
 # -------- Main --------
+def detect_width_arg(value: str) -> int:
+    """argparse type for --detect-width: a positive multiple of YOLO's 32px stride."""
+    width = int(value)
+    if width <= 0 or width % 32:
+        raise argparse.ArgumentTypeError(f"must be a positive multiple of 32, got {value}")
+    return width
+
+def jpeg_quality_arg(value: str) -> int:
+    """argparse type for --jpeg-quality: an IMWRITE_JPEG_QUALITY value in 1-100."""
+    quality = int(value)
+    if not 1 <= quality <= 100:
+        raise argparse.ArgumentTypeError(f"must be between 1 and 100, got {value}")
+    return quality
+
+def conf_arg(value: str) -> float:
+    """argparse type for --conf: a confidence threshold in 0-1."""
+    conf = float(value)
+    if not 0.0 <= conf <= 1.0:
+        raise argparse.ArgumentTypeError(f"must be between 0 and 1, got {value}")
+    return conf
+
 def main():
     ap = argparse.ArgumentParser(description="Dual camera MJPEG streamer with YOLOv11n face detection & blurring")
     ap.add_argument("--cam0", type=str, default="0")
@@ -174,6 +470,20 @@ def main():
     ap.add_argument("--height", type=int, default=360)
     ap.add_argument("--host", type=str, default="0.0.0.0")
     ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--model", type=str, default=MODEL_PATH,
+                    help="YOLO weights or export (e.g. best.onnx, best_int8_openvino_model/)")
+    ap.add_argument("--device", type=str, default=None,
+                    help="Inference device, e.g. cpu, 0 (CUDA GPU), mps; default: auto")
+    ap.add_argument("--half", action="store_true",
+                    help="FP16 inference (CUDA GPUs and FP16-capable exports)")
+    ap.add_argument("--jpeg-quality", type=jpeg_quality_arg, default=JPEG_QUALITY,
+                    help="MJPEG stream quality (1-100); lower is cheaper to encode")
+    ap.add_argument("--detect-width", type=detect_width_arg, default=DETECT_WIDTH,
+                    help="YOLO input width (multiple of 32); lower is faster, misses smaller faces")
+    ap.add_argument("--conf", type=conf_arg, default=DETECT_CONF,
+                    help="Minimum face confidence")
+    ap.add_argument("--no-overlay", action="store_true",
+                    help="Don't draw the FPS text into frames (FPS is still served on /stats)")
     args = ap.parse_args()
 
     cap0 = open_cam(args.cam0, args.width, args.height)
@@ -183,11 +493,23 @@ def main():
     if not cap1.isOpened():
         raise RuntimeError(f"Cannot open camera {args.cam1}")
 
-    fps0 = FPSMeter()
-    fps1 = FPSMeter()
+    # Each camera runs its own detector thread; give each half the cores
+    # instead of two all-core torch pools fighting over the same CPUs.
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // 2))
+
+    pipe0 = CameraPipeline(cap0, FPSMeter(), "cam0", args.model, args.device,
+                           args.jpeg_quality, args.detect_width, args.conf,
+                           not args.no_overlay, args.half).start()
+    pipe1 = CameraPipeline(cap1, FPSMeter(), "cam1", args.model, args.device,
+                           args.jpeg_quality, args.detect_width, args.conf,
+                           not args.no_overlay, args.half).start()
 
-    app = build_app(cap0, cap1, fps0, fps1)
-    app.run(host=args.host, port=args.port, threaded=True)
+    app = build_app(pipe0, pipe1)
+    try:
+        app.run(host=args.host, port=args.port, threaded=True)
+    finally:
+        pipe0.stop()
+        pipe1.stop()
 
 if __name__ == "__main__":
     main()